@@ -1,16 +1,58 @@
 import os 
+from functools import lru_cache
 from langchain_core.tools import tool
 import sqlite3
-from langchain.chat_models import init_chat_model
+from agents.llm import init_cached_chat_model
+from agents.schema_index import get_schema_index, select_tables
 
-model = init_chat_model("gpt-4.1-mini", model_provider= "openai")
+model = init_cached_chat_model("gpt-4.1-mini", model_provider= "openai")
+# routing and classification calls are pinned to temperature 0, which also makes them cacheable
+classifier_model = model.bind(temperature=0)
 DB_PATH = os.environ['DB_PATH']
 
+# Databases with more tables than this pick their tables through the schema index instead of the model
+SCHEMA_INDEX_MIN_TABLES = 30
+SCHEMA_INDEX_TOP_N = 10
+
 # Supporting function 
 def create_cursor(path_to_db:str):
     connection = sqlite3.connect(path_to_db)
     return connection.cursor()
 
+def db_version(path_to_db:str):
+    # the modification time changes whenever the database file is written, so cached entries expire with it
+    return os.path.getmtime(path_to_db)
+
+# Table lists and schemas are shared by every question against the same database version
+@lru_cache(maxsize=32)
+def cached_table_list(db_name, version):
+    cursor = create_cursor(db_name)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    return tuple(table[0] for table in cursor.fetchall())
+
+@lru_cache(maxsize=1024)
+def cached_table_schema(table, db_name, version):
+    cursor = create_cursor(db_name)
+    cursor.execute(f"PRAGMA table_info({table});")
+    column_list = cursor.fetchall()  
+
+    # constructing output 
+    constructed_tbl_info = ""
+    if len(column_list) == 0: 
+        field_names = "Table is not found. Try a different name."
+    else:
+        field_names = " | ".join([column[0] for column in cursor.description])
+        for column in column_list: 
+            cid = column[0]
+            name = column[1]
+            type = column[2]
+            notnull =  "True" if column[3] == 1 else "False"
+            default_value = column[4]
+            pk = "Primary Key" if column[5] == 1 else "Not PK"
+            constructed_tbl_info += f"\t{cid} | {name} | {type} | {notnull} | {default_value} | {pk} \n"
+
+    return f"""Table name: {table}\n\t{field_names}\n{constructed_tbl_info}\n"""
+
 @tool("get_table_list", parse_docstring=True)
 def get_table_list(db_name):
     """ 
@@ -22,15 +64,8 @@ def get_table_list(db_name):
         Return: 
         list of table names
     """
-    # create a cursor 
-    cursor = create_cursor(db_name)
-
     # get table list
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = cursor.fetchall()  
-
-    # return
-    return [table[0] for table in tables]
+    return list(cached_table_list(db_name, db_version(db_name)))
 
 @tool("get_table_schema", parse_docstring=True)
 def get_table_schema(table_list, db_name):
@@ -44,33 +79,18 @@ def get_table_schema(table_list, db_name):
         Return: 
         A string containing schema of tables in the table_list
     """
-    # create a cursor 
-    cursor = create_cursor(db_name)
-
     # get table info
-    output_string = ""
-    for table in table_list: 
-        cursor.execute(f"PRAGMA table_info({table});")
-        column_list = cursor.fetchall()  
-    
-        # constructing output 
-        constructed_tbl_info = ""
-        if len(column_list) == 0: 
-            field_names = "Table is not found. Try a different name."
-        else:
-            field_names = " | ".join([column[0] for column in cursor.description])
-            for column in column_list: 
-                cid = column[0]
-                name = column[1]
-                type = column[2]
-                notnull =  "True" if column[3] == 1 else "False"
-                default_value = column[4]
-                pk = "Primary Key" if column[5] == 1 else "Not PK"
-                constructed_tbl_info += f"\t{cid} | {name} | {type} | {notnull} | {default_value} | {pk} \n"
-
-        output_string += f"""Table name: {table}\n\t{field_names}\n{constructed_tbl_info}\n"""
-
-    return output_string
+    version = db_version(db_name)
+    return "".join(cached_table_schema(table, db_name, version) for table in table_list)
+
+def warm_schema_cache(db_name):
+    """ Load the table list and every table schema once, e.g. before a batch run. """
+    version = db_version(db_name)
+    tables = cached_table_list(db_name, version)
+    for table in tables:
+        cached_table_schema(table, db_name, version)
+    if len(tables) > SCHEMA_INDEX_MIN_TABLES:
+        get_schema_index(db_name)
 
 ## tool for running query 
 @tool("running_query", parse_docstring=True)
@@ -113,11 +133,14 @@ from typing import Any, Annotated, Literal
 from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, SystemMessage
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from agents.prompts import (build_prompt, GET_SCHEMA_INSTRUCTION, WRITE_QUERY_INSTRUCTION, CHECK_QUERY_INSTRUCTION,
+                            RUN_QUERY_INSTRUCTION, FINAL_ANSWER_INSTRUCTION, IS_ENOUGH_INSTRUCTION)
 
 # expand the MessagesState
 class DBGraphState(MessagesState):
     db_name: Annotated[Any, "Database location"]
     user_question: Annotated[str, "User question that must be answered by querying the database"]
+    candidate_tables: Annotated[list, "Tables selected by the schema index, only set for large databases"]
 
 # the first node
 def list_tables(state: DBGraphState):
@@ -131,23 +154,52 @@ def list_tables(state: DBGraphState):
     }
     tool_call_message = AIMessage(content="I am calling a tool to get list of tables from the database.", tool_calls=[tool_call])
     tool_message = get_table_list.invoke(tool_call)
+
+    # large databases: only show the tables most relevant to the question
+    table_count = len(cached_table_list(state["db_name"], db_version(state["db_name"])))
+    if table_count > SCHEMA_INDEX_MIN_TABLES:
+        candidate_tables = select_tables(state["user_question"], state["db_name"], SCHEMA_INDEX_TOP_N)
+        response = AIMessage(content=f"Available tables (most relevant to the question): {candidate_tables}")
+        return {'messages': response, 'candidate_tables': candidate_tables}
+
     response = AIMessage(content=f"Available tables: {tool_message.content}")
 
-    return {'messages': response}
+    return {'messages': response, 'candidate_tables': []}
+
+# Prompts keep the static instructions and the schema in front and the request-specific content last,
+# so the provider can reuse its prompt cache across questions (see agents/prompts.py)
+def schema_and_attempts(state: DBGraphState):
+    """ Split the messages into the fetched table schema and everything produced after it. """
+    for index in range(len(state["messages"]) - 1, -1, -1):
+        message = state["messages"][index]
+        if message.type == "tool" and message.name == "get_table_schema":
+            return f"Database schema:\n{message.content}", state["messages"][index + 1:]
+    return "Database schema is not available.", state["messages"]
 
 # the second node
+schema_model = model.bind_tools([get_table_schema], tool_choice="any").bind(temperature=0)
+
 def get_schema_node(state: DBGraphState):
     
     input_question = state["user_question"]
     available_tables = state["messages"][-1]
     db_name = state["db_name"]
-    instruction = [SystemMessage(content=f'''You are a business analyst from Dexa and an SQL expert. You receive a question from the user and a list of available
-                                table in the database. Use the tool to get the structures of possible tables that you will use to construct the query later.
-                                db_name = {db_name}
-                                Here is the question from the user: {input_question}''')
-                    ] + [available_tables]
-    model_with_tools = model.bind_tools([get_table_schema], tool_choice="any")
-    response = model_with_tools.invoke(instruction)
+
+    # tables already selected by the schema index: fetch their schemas without asking the model
+    if state.get("candidate_tables"):
+        tool_call = {
+            "name": "get_table_schema",
+            "args": {"table_list": state["candidate_tables"], "db_name": db_name},
+            "id": f"schema_index_{len(state['messages'])}",
+            "type": "tool_call"
+        }
+        return {"messages": AIMessage(content="", tool_calls=[tool_call])}
+
+    instruction = build_prompt(
+        [GET_SCHEMA_INSTRUCTION, available_tables],
+        [f"db_name = {db_name}\nHere is the question from the user: {input_question}"],
+    )
+    response = schema_model.invoke(instruction)
 
     # invoking tool 
     return {"messages": response}
@@ -156,58 +208,27 @@ invoking_tool_node = ToolNode([get_table_schema], name="invoking_tool_node")
 ## Let's build the node
 
 def write_query(state:DBGraphState):
-    dialect = "sqlite"
-    top_k = 10
-    instruction = SystemMessage(content=f'''You are an agent designed to interact with a SQL database.
-                        Given an input question, create a syntactically correct {dialect} query to run,
-                        then look at the results of the query and return the answer. Unless the user
-                        specifies a specific number of examples they wish to obtain, always limit your
-                        query to at most {top_k} results.
-
-                        You can order the results by a relevant column to return the most interesting
-                        examples in the database. Never query for all the columns from a specific table,
-                        only ask for the relevant columns given the question.
-
-                        DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the database.''')
-    
-    response = model.invoke([instruction] + state["messages"])    
+    schema, attempts = schema_and_attempts(state)
+    instruction = build_prompt([WRITE_QUERY_INSTRUCTION, schema], [state["user_question"]] + attempts)
+    response = model.invoke(instruction)    
    
     return {"messages": response}
 
 def check_query(state: DBGraphState):
-    dialect = 'sqlite'
-    instruction = SystemMessage(content=f'''You are a SQL expert with a strong attention to detail.
-    Double check the {dialect} query for common mistakes, including:
-    - Using NOT IN with NULL values
-    - Using UNION when UNION ALL should have been used
-    - Using BETWEEN for exclusive ranges
-    - Data type mismatch in predicates
-    - Properly quoting identifiers
-    - Using the correct number of arguments for functions
-    - Casting to the correct data type
-    - Using the proper columns for joins
-
-    If there are any of the above mistakes, rewrite the query. If there are no mistakes,
-    just reproduce the original query.
-
-    Forbid any DML statements (INSERT, UPDATE, DELETE, DROP, TRUNCATE). If the query statement contains those statements, respond by "Forbidden query"
-    ''')
-    
-    response = model.invoke([instruction] + state["messages"])    
+    schema, attempts = schema_and_attempts(state)
+    instruction = build_prompt([CHECK_QUERY_INSTRUCTION, schema], [state["user_question"]] + attempts)
+    response = classifier_model.invoke(instruction)    
     return {"messages": response}
 
+run_query_model = model.bind_tools([running_query])
+
 def run_query_node(state:DBGraphState):
     query_checking_result = state["messages"][-1]
-    dialect = 'sqlite'
     db_name = DB_PATH
-    instruction = [SystemMessage(content=f'''If the last node is resulted in a forbidden query, proceed to the next node, explain why it is forbidden and skip calling tool.
-                                 If the result is a valid {dialect} query statement, run the query by calling the given tool.
-                                database_name = {db_name}
-                                '''), query_checking_result]
+    instruction = build_prompt([RUN_QUERY_INSTRUCTION, f"database_name = {db_name}"], [query_checking_result])
     
     # Let the model decide 
-    model_with_tools = model.bind_tools([running_query])
-    model_response = model_with_tools.invoke(instruction)
+    model_response = run_query_model.invoke(instruction)
     
     response = [model_response]
     
@@ -225,12 +246,10 @@ def run_query_node(state:DBGraphState):
 def final_answer(state:DBGraphState):
     user_question = state['user_question']
     query_result = state['messages'][-1]
-    instruction= [SystemMessage(content=f'''Decide whether you can answer user question from the query result. If you have enough information, 
-                               respond with the answer. 
-                               If you do not have enough information, tell me your plan to get more accurate answer.
-                               Here is the user question: {user_question}
-                               Here is the query result: \n {query_result}
-                               ''')]
+    instruction = build_prompt(
+        [FINAL_ANSWER_INSTRUCTION],
+        [f"Here is the user question: {user_question}\nHere is the query result: \n {query_result.content}"],
+    )
     response = model.invoke(instruction)
 
     return {"messages": response}
@@ -239,13 +258,9 @@ def final_answer(state:DBGraphState):
 def is_enough(state:DBGraphState) -> Literal['write_query', END]:
     user_question = state['user_question']
     last_responses = state['messages'][-3:]
-    instruction = [SystemMessage(content=f"""Answer only with 'enough' or 'not enough'. Answer with 'enough', if your response indicate that 
-                                there is enough information from the tool message to answer user question. Answer with 'enough' when 
-                                the user asks you to perform a forbidden query. Answer with 'not enough' if otherwise.
-                                User question = {user_question}""")
-                                ] + last_responses
+    instruction = build_prompt([IS_ENOUGH_INSTRUCTION], [f"User question = {user_question}"] + last_responses)
 
-    response = model.invoke(instruction)
+    response = classifier_model.invoke(instruction)
     response.content
     if response.content == 'enough':
         return END
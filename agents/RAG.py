@@ -1,5 +1,5 @@
-from langchain.chat_models import init_chat_model
-from langchain_huggingface import HuggingFaceEmbeddings
+from agents.llm import init_cached_chat_model
+from agents.embeddings import EMBEDDING_MODEL_NAME, INDEX_DIR, get_embedding_model
 from langchain_core.vectorstores import InMemoryVectorStore
 from langchain_core.tools import tool
 from langgraph.graph import MessagesState, StateGraph
@@ -9,41 +9,117 @@ from langgraph.graph import END
 from langgraph.prebuilt import ToolNode, tools_condition
 
 
+import os
+import hashlib
+import json
+from agents.bm25 import FORMAT_VERSION as BM25_FORMAT_VERSION, BM25Index, reciprocal_rank_fusion
+from agents.context import assemble_context
+from agents.prompts import build_prompt, RAG_GENERATE_INSTRUCTION
+
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
-embedding_model = HuggingFaceEmbeddings(model_name="intfloat/multilingual-e5-large-instruct")
-vector_store = InMemoryVectorStore(embedding_model)
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 100
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+embedding_model = get_embedding_model()
 
 file_path = "./docs/Tentang Dexa Medica.pdf"
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+# The vector index and the BM25 index are persisted side by side and rebuilt when the PDF changes.
+# The file names carry a fingerprint of the indexing settings, so changing any of them builds a new index.
+index_settings = {
+    "embedding_model": EMBEDDING_MODEL_NAME,
+    "chunk_size": CHUNK_SIZE,
+    "chunk_overlap": CHUNK_OVERLAP,
+    "add_start_index": True,
+    "bm25_k1": BM25_K1,
+    "bm25_b": BM25_B,
+    "bm25_format": BM25_FORMAT_VERSION,
+}
+index_fingerprint = hashlib.sha256(json.dumps(index_settings, sort_keys=True).encode()).hexdigest()[:12]
+vector_index_path = os.path.join(INDEX_DIR, f"dexa_medica_vectors_{index_fingerprint}.json")
+bm25_index_path = os.path.join(INDEX_DIR, f"dexa_medica_bm25_{index_fingerprint}.json")
+
+def index_is_fresh():
+    if not (os.path.exists(vector_index_path) and os.path.exists(bm25_index_path)):
+        return False
+    source_mtime = os.path.getmtime(file_path)
+    return os.path.getmtime(vector_index_path) >= source_mtime and os.path.getmtime(bm25_index_path) >= source_mtime
+
+if index_is_fresh():
+    vector_store = InMemoryVectorStore.load(vector_index_path, embedding_model)
+    bm25_index = BM25Index.load(bm25_index_path)
+else:
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    loader = PyPDFLoader(file_path)
+    docs = loader.load()
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=index_settings["add_start_index"]
+    )
+    all_splits = text_splitter.split_documents(docs)
+    vector_store = InMemoryVectorStore(embedding_model)
+    split_ids = vector_store.add_documents(all_splits)
+
+    # the BM25 index uses the same ids so both rankings can be fused
+    bm25_index = BM25Index(k1=BM25_K1, b=BM25_B)
+    bm25_index.add(split_ids, [split.page_content for split in all_splits])
+
+    vector_store.dump(vector_index_path)
+    bm25_index.save(bm25_index_path)
+
+# Query embeddings computed ahead of time, e.g. one batched call for all questions of a batch run
+query_embedding_cache = {}
+QUERY_EMBEDDING_CACHE_SIZE = 10000
 
-loader = PyPDFLoader(file_path)
-docs = loader.load()
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=500, chunk_overlap=100
-)
-all_splits = text_splitter.split_documents(docs)
-vector_store.add_documents(all_splits)
+def prime_query_embeddings(queries):
+    """ Embed many queries with a single batched call and keep them for retrieval. """
+    queries = [query for query in dict.fromkeys(queries) if query not in query_embedding_cache]
+    if not queries:
+        return
+    if len(query_embedding_cache) + len(queries) > QUERY_EMBEDDING_CACHE_SIZE:
+        query_embedding_cache.clear()
+    query_embedding_cache.update(zip(queries, embedding_model.embed_documents(queries)))
 
+query_embedding_stats = {"hits": 0, "misses": 0}
 
-llm = init_chat_model("gpt-4.1-mini", model_provider="openai")
+def embed_query(query: str):
+    if query in query_embedding_cache:
+        query_embedding_stats["hits"] += 1
+        return query_embedding_cache[query]
+    query_embedding_stats["misses"] += 1
+    return embedding_model.embed_query(query)
+
+def hybrid_search(query: str, k: int = 5, candidates: int = 20):
+    """
+        Retrieve chunks by fusing dense (embedding) and lexical (BM25) rankings with reciprocal-rank fusion.
+        The lexical ranking catches exact product names and codes that dense search misses.
+    """
+    dense_ranking = [doc.id for doc in vector_store.similarity_search_by_vector(embed_query(query), k=candidates)]
+    lexical_ranking = [doc_id for doc_id, _ in bm25_index.search(query, k=candidates)]
+    fused = reciprocal_rank_fusion([dense_ranking, lexical_ranking])[:k]
+    return vector_store.get_by_ids([doc_id for doc_id, _ in fused])
+
+
+CONTEXT_TOKEN_BUDGET = 1500
+
+llm = init_cached_chat_model("gpt-4.1-mini", model_provider="openai")
 @tool(response_format="content_and_artifact")
 def retrieve(query: str):
     """Retrieve information related to a query."""
-    retrieved_docs = vector_store.similarity_search(query, k=5)
-    serialized = "\n\n".join(
-        (f"Source: {doc.metadata}\n" f"Content: {doc.page_content}")
-        for doc in retrieved_docs
-    )
+    retrieved_docs = hybrid_search(query, k=5)
+    serialized = assemble_context(retrieved_docs)
     return serialized, retrieved_docs
 
 # Step 1: Generate an AIMessage that may include a tool-call to be sent.
+llm_with_tools = llm.bind_tools([retrieve])
+
 def query_or_respond(state: MessagesState):
     """Generate tool call for retrieval or respond."""
-    llm_with_tools = llm.bind_tools([retrieve])
     response = llm_with_tools.invoke(state["messages"])
     # MessagesState appends messages to state instead of overwriting
     return {"messages": [response]}
@@ -63,23 +139,23 @@ def generate(state: MessagesState):
             break
     tool_messages = recent_tool_messages[::-1]
 
-    # Format into prompt
-    docs_content = "\n\n".join(doc.content for doc in tool_messages)
-    system_message_content = (
-        "You are an assistant for question-answering tasks. "
-        "Use the following pieces of retrieved context to answer "
-        "the question. If you don't know the answer, say that you "
-        "don't know. Keep the answer concise."
-        "\n\n"
-        f"{docs_content}"
-    )
+    # Format into prompt: merge, deduplicate and budget all retrieved chunks together
+    retrieved_docs = [doc for message in tool_messages for doc in (message.artifact or [])]
+    if retrieved_docs:
+        docs_content = assemble_context(retrieved_docs, token_budget=CONTEXT_TOKEN_BUDGET)
+    else:
+        docs_content = "\n\n".join(doc.content for doc in tool_messages)
     conversation_messages = [
         message
         for message in state["messages"]
         if message.type in ("human", "system")
         or (message.type == "ai" and not message.tool_calls)
     ]
-    prompt = [SystemMessage(system_message_content)] + conversation_messages
+    # static instruction first and the retrieved context last, so the prompt prefix stays cacheable
+    prompt = build_prompt(
+        [RAG_GENERATE_INSTRUCTION],
+        conversation_messages + [SystemMessage(f"Retrieved context:\n\n{docs_content}")],
+    )
 
     # Run
     response = llm.invoke(prompt)
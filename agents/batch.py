@@ -0,0 +1,236 @@
+"""
+Batch question answering for the DBQNA and RAG graphs.
+
+Usage:
+    python -m agents.batch dbqna questions.jsonl results.jsonl --max-concurrency 8 --requests-per-second 5
+
+Every line of the input file is a JSON object with a "question" and an optional "id"
+(the line number is used when it is missing). Results are appended to the output file as soon as
+they finish, so an interrupted run can be restarted with the same command: questions that already
+have a successful result are skipped. At the end of a run the file is rewritten with only the latest
+record of every id; while a run is in progress or after it was interrupted, readers must keep the
+last record per id. Each successful record also holds the share of prompt tokens of the final model
+call that the provider served from its prompt cache.
+
+The RAG graph runs in two phases, in chunks of a few times --max-concurrency questions: the model
+first writes the retrieval query for every question of the chunk, then all of its queries are embedded
+in one batched call, then every question resumes from there and its result is written. A crash
+loses at most the planning of the chunk that was running, answers already written are kept.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+
+from langchain_core.messages import HumanMessage
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langgraph.checkpoint.memory import InMemorySaver
+from agents.llm import cached_token_ratio, llm_cache_stats
+
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+# module holding the compiled graph and the chat models it calls
+GRAPH_MODULES = {
+    "dbqna": "agents.DBQNA",
+    "rag": "agents.RAG",
+}
+# chat model attributes of each module, grouped by provider so they share one rate limiter
+GRAPH_MODELS = {
+    "dbqna": {"openai": ["model"]},
+    "rag": {"openai": ["llm"]},
+}
+# graphs run in two phases: up to this node for every question, then the shared work, then the rest
+PLANNING_NODES = {
+    "rag": "query_or_respond",
+}
+# two-phase graphs run in chunks of this many times max_concurrency questions, so a crash loses at most one chunk
+PLANNING_CHUNK_FACTOR = 4
+
+def read_questions(path):
+    """ Read the input file, rejecting lines without a question and ids used twice (they would share a graph thread). """
+    questions = []
+    seen = {}
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "question" not in record:
+                raise ValueError(f"{path}:{line_number}: missing \"question\"")
+            question_id = str(record.get("id", line_number))
+            if question_id in seen:
+                raise ValueError(f"{path}:{line_number}: id {question_id!r} is already used on line {seen[question_id]}")
+            seen[question_id] = line_number
+            questions.append({"id": question_id, "question": record["question"]})
+    return questions
+
+def completed_ids(path):
+    """ Ids that already have a successful result in the output file. """
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut short by a crash
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+def compact_results(path):
+    """ Rewrite the output file with only the latest record of every id. """
+    latest = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # keep the position of the first record, the content of the last one
+            latest[record["id"]] = record
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        for record in latest.values():
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(temporary_path, path)
+
+def apply_rate_limits(graph_name, module, requests_per_second):
+    """ Attach one rate limiter per provider to the chat models used by the graph. """
+    for provider, attributes in GRAPH_MODELS[graph_name].items():
+        limiter = InMemoryRateLimiter(requests_per_second=requests_per_second, max_bucket_size=max(1, requests_per_second))
+        for attribute in attributes:
+            # limit the wrapped model, so requests served by the LLM cache are not throttled
+            getattr(module, attribute).model.rate_limiter = limiter
+
+def prepare_shared_work(graph_name, module):
+    """ Do the work every question needs once for the whole batch, before any question runs. """
+    if graph_name == "dbqna":
+        module.warm_schema_cache(module.DB_PATH)
+
+def retrieval_queries(state):
+    """ Queries the model wrote for the retrieve tool in the last planning step. """
+    last_message = state["messages"][-1]
+    return [tool_call["args"]["query"] for tool_call in getattr(last_message, "tool_calls", []) if tool_call["name"] == "retrieve"]
+
+def prepare_planned_work(graph_name, module, states):
+    """ Do the shared work that depends on the planning phase of every question. """
+    if graph_name == "rag":
+        # one batched embedding call for all retrieval queries of the batch
+        module.prime_query_embeddings([query for state in states for query in retrieval_queries(state)])
+
+def graph_input(graph_name, module, question):
+    if graph_name == "dbqna":
+        return {"messages": HumanMessage(content=question), "db_name": module.DB_PATH, "user_question": question}
+    return {"messages": HumanMessage(content=question)}
+
+async def run_batch(graph_name, input_path, output_path, max_concurrency=8, requests_per_second=None):
+    """
+        Run all questions of a JSONL file through a graph and stream the answers to a JSONL file.
+
+        Args:
+        graph_name = "dbqna" or "rag"
+        input_path = JSONL file with questions
+        output_path = JSONL file the results are appended to
+        max_concurrency = maximum number of questions processed at the same time
+        requests_per_second = maximum model requests per second per provider, no limit if None
+
+        Return:
+        number of questions that failed
+    """
+    module = importlib.import_module(GRAPH_MODULES[graph_name])
+    if requests_per_second:
+        apply_rate_limits(graph_name, module, requests_per_second)
+
+    done = completed_ids(output_path)
+    pending = [item for item in read_questions(input_path) if item["id"] not in done]
+    if not pending:
+        if os.path.exists(output_path):
+            compact_results(output_path)
+        return 0
+    prepare_shared_work(graph_name, module)
+
+    # a checkpointed copy of the graph that pauses after the planning node, so the shared work can be done in between
+    graph = module.graph
+    planning_node = PLANNING_NODES.get(graph_name)
+    if planning_node:
+        graph = module.graph.builder.compile(checkpointer=InMemorySaver(), interrupt_after=[planning_node], name=module.graph.name)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    def thread(item):
+        return {"configurable": {"thread_id": item["id"]}}
+
+    async def plan(item):
+        async with semaphore:
+            try:
+                await graph.ainvoke(graph_input(graph_name, module, item["question"]), thread(item))
+                return item, (await graph.aget_state(thread(item))).values, None
+            except Exception as e:
+                return item, None, {**item, "status": "error", "error": f"{type(e).__name__}: {e}"}
+
+    async def answer(item):
+        async with semaphore:
+            try:
+                if planning_node:
+                    # resume from the pause after the planning node
+                    response = await graph.ainvoke(None, thread(item))
+                else:
+                    response = await graph.ainvoke(graph_input(graph_name, module, item["question"]))
+                final_message = response["messages"][-1]
+                return {**item, "status": "ok", "answer": final_message.content,
+                        "cached_token_ratio": cached_token_ratio(final_message)}
+            except Exception as e:
+                return {**item, "status": "error", "error": f"{type(e).__name__}: {e}"}
+
+    failures = 0
+    with open(output_path, "a", encoding="utf-8") as f:
+        def write(result):
+            nonlocal failures
+            failures += result["status"] != "ok"
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.flush()
+
+        chunk_size = max_concurrency * PLANNING_CHUNK_FACTOR if planning_node else len(pending)
+        for chunk_start in range(0, len(pending), chunk_size):
+            chunk = pending[chunk_start:chunk_start + chunk_size]
+            if planning_node:
+                planned = await asyncio.gather(*[plan(item) for item in chunk])
+                for _, _, error in planned:
+                    if error:
+                        write(error)
+                chunk = [item for item, _, error in planned if not error]
+                prepare_planned_work(graph_name, module, [state for _, state, error in planned if not error])
+
+            for task in asyncio.as_completed([answer(item) for item in chunk]):
+                write(await task)
+
+    # drop the error records of questions that were retried
+    compact_results(output_path)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the DBQNA or RAG graph.")
+    parser.add_argument("graph", choices=sorted(GRAPH_MODULES))
+    parser.add_argument("input", help="JSONL file with one {\"id\": ..., \"question\": ...} object per line")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=None)
+    args = parser.parse_args()
+
+    failures = asyncio.run(run_batch(args.graph, args.input, args.output, args.max_concurrency, args.requests_per_second))
+    print(f"LLM cache: {llm_cache_stats()}")
+    if args.graph == "rag":
+        print(f"Query embedding cache: {sys.modules[GRAPH_MODULES['rag']].query_embedding_stats}")
+    if failures:
+        print(f"{failures} question(s) failed, run the same command again to retry them.")
+    raise SystemExit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import base64
+import heapq
+import json
+import math
+import re
+import sys
+from array import array
+from collections import Counter
+
+# Unicode-aware so Indonesian text and product codes like "OBH-100" are split into searchable tokens
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+# version of the file layout written by BM25Index.save, part of the RAG index fingerprint
+FORMAT_VERSION = 2
+
+def encode_array(values: array) -> str:
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+def decode_array(text: str, byteorder: str) -> array:
+    values = array("I")
+    values.frombytes(base64.b64decode(text))
+    if byteorder != sys.byteorder:
+        values.byteswap()
+    return values
+
+def tokenize(text: str):
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """
+        Inverted index with precomputed BM25 statistics.
+
+        Postings are stored per term as two parallel arrays (document positions and term frequencies)
+        so the index stays compact in memory and on disk. Scoring only touches the postings of the
+        query terms, which keeps the lexical search cheap enough to be used as a pre-filter.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self.doc_lengths = array("I")
+        self.postings = {}
+        self.avg_doc_length = 0.0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def add(self, doc_ids, texts):
+        """ Add documents to the index. doc_ids must match the ids used in the vector store. """
+        for doc_id, text in zip(doc_ids, texts):
+            position = len(self.doc_ids)
+            term_counts = Counter(tokenize(text))
+            self.doc_ids.append(doc_id)
+            self.doc_lengths.append(sum(term_counts.values()))
+            for term, frequency in term_counts.items():
+                if term not in self.postings:
+                    self.postings[term] = (array("I"), array("I"))
+                positions, frequencies = self.postings[term]
+                positions.append(position)
+                frequencies.append(frequency)
+
+        self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def idf(self, term: str) -> float:
+        document_frequency = len(self.postings[term][0]) if term in self.postings else 0
+        return math.log(1 + (len(self.doc_ids) - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def search(self, query: str, k: int = 5):
+        """ Return the top k (doc_id, score) pairs for the query, best first. """
+        scores = {}
+        k1, b, avg_length = self.k1, self.b, self.avg_doc_length or 1.0
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            idf = self.idf(term)
+            positions, frequencies = self.postings[term]
+            for position, frequency in zip(positions, frequencies):
+                norm = k1 * (1 - b + b * self.doc_lengths[position] / avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.doc_ids[position], score) for position, score in top]
+
+    # persistence: the posting arrays are stored as their raw bytes (base64), not as lists of numbers
+    def save(self, path: str):
+        data = {
+            "format": FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "byteorder": sys.byteorder,
+            "itemsize": self.doc_lengths.itemsize,
+            "doc_ids": self.doc_ids,
+            "doc_lengths": encode_array(self.doc_lengths),
+            "postings": {term: [encode_array(positions), encode_array(frequencies)]
+                         for term, (positions, frequencies) in self.postings.items()},
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != FORMAT_VERSION or data["itemsize"] != array("I").itemsize:
+            raise ValueError(f"{path} was written by an incompatible BM25Index, rebuild the index")
+
+        byteorder = data["byteorder"]
+        index = cls(k1=data["k1"], b=data["b"])
+        index.doc_ids = data["doc_ids"]
+        index.doc_lengths = decode_array(data["doc_lengths"], byteorder)
+        index.postings = {term: (decode_array(positions, byteorder), decode_array(frequencies, byteorder))
+                          for term, (positions, frequencies) in data["postings"].items()}
+        index.avg_doc_length = sum(index.doc_lengths) / len(index.doc_lengths) if index.doc_lengths else 0.0
+        return index
+
+def reciprocal_rank_fusion(rankings, k: int = 60):
+    """
+        Fuse several ranked lists of ids into one ranking.
+
+        Args:
+        rankings = list of rankings, each one a list of ids ordered best first
+        k = smoothing constant, 60 is the value from the original RRF paper
+
+        Return:
+        list of (id, fused score) ordered best first
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
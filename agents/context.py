@@ -0,0 +1,130 @@
+import os
+import re
+import zlib
+
+import tiktoken
+
+# gpt-4.1 family tokenizer, loaded on first use because tiktoken may have to download it
+ENCODING_NAME = "o200k_base"
+encoding = None
+
+def get_encoding():
+    global encoding
+    if encoding is None:
+        encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return encoding
+
+SHINGLE_SIZE = 4
+# a block whose shingles are mostly contained in an already kept block is treated as a duplicate
+DUPLICATE_CONTAINMENT = 0.8
+# chunks closer than this many characters are treated as adjacent and merged
+ADJACENT_GAP = 2
+# minimum overlap for chunks without a start_index (documents not split with add_start_index=True), found by text
+MIN_TEXT_OVERLAP = 20
+
+def shingles(text: str):
+    """ Hashed word shingles of a text, cheap to compare for near-duplicate detection. """
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {zlib.crc32(" ".join(words).encode())}
+    return {zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode()) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def text_overlap(left: str, right: str) -> int:
+    """ Length of the longest suffix of left that is also a prefix of right. """
+    for size in range(min(len(left), len(right)), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def citation(metadata: dict) -> str:
+    source = os.path.basename(metadata.get("source", "unknown"))
+    page = metadata.get("page_label") or (metadata["page"] + 1 if "page" in metadata else None)
+    return f"{source} p.{page}" if page is not None else source
+
+def merge_chunks(docs):
+    """
+        Merge overlapping or adjacent chunks that come from the same page.
+
+        Return:
+        list of (metadata, text) blocks, ordered by the best retrieval rank of their chunks
+    """
+    # group chunks by page, each chunk with its retrieval rank
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    blocks = []
+    for group in groups.values():
+        group = sorted(group, key=lambda item: item[1].metadata.get("start_index", 0))
+        best_rank, first = group[0]
+        current_text = first.page_content
+        current_start = first.metadata.get("start_index")
+        # end offset in the page, tracked separately because adjacent merges join with a space instead of the real gap
+        current_end = current_start + len(current_text) if current_start is not None else None
+        for rank, doc in group[1:]:
+            start = doc.metadata.get("start_index")
+            if current_start is not None and start is not None:
+                end = start + len(doc.page_content)
+                if start <= current_end:
+                    current_text += doc.page_content[current_end - start:]
+                    current_end = max(current_end, end)
+                    best_rank = min(best_rank, rank)
+                    continue
+                if start - current_end <= ADJACENT_GAP:
+                    current_text += " " + doc.page_content
+                    current_end = end
+                    best_rank = min(best_rank, rank)
+                    continue
+            else:
+                overlap = text_overlap(current_text, doc.page_content)
+                if overlap:
+                    current_text += doc.page_content[overlap:]
+                    best_rank = min(best_rank, rank)
+                    continue
+            blocks.append((best_rank, first.metadata, current_text))
+            best_rank, current_text, current_start = rank, doc.page_content, start
+            current_end = start + len(doc.page_content) if start is not None else None
+        blocks.append((best_rank, first.metadata, current_text))
+
+    blocks.sort(key=lambda block: block[0])
+    return [(metadata, text) for _, metadata, text in blocks]
+
+def assemble_context(docs, token_budget: int = 1500) -> str:
+    """
+        Turn retrieved chunks into a compact context for the generation prompt:
+        merges overlapping chunks, drops near-duplicates, replaces metadata with short citations
+        and stops once the token budget is used.
+
+        Args:
+        docs = retrieved documents, best first
+        token_budget = maximum number of tokens of the returned context
+
+        Return:
+        context string
+    """
+    kept = []
+    for metadata, text in merge_chunks(docs):
+        text_shingles = shingles(text)
+        is_duplicate = any(
+            len(text_shingles & kept_shingles) >= DUPLICATE_CONTAINMENT * len(text_shingles)
+            for _, _, kept_shingles in kept
+        )
+        if not is_duplicate:
+            kept.append((metadata, text, text_shingles))
+
+    encoding = get_encoding()
+    parts = []
+    remaining = token_budget
+    for number, (metadata, text, _) in enumerate(kept, start=1):
+        block = f"[{number}] ({citation(metadata)}) {text}"
+        tokens = encoding.encode(block)
+        if len(tokens) > remaining:
+            # keep a truncated version of the block if a meaningful part still fits
+            if remaining > 50:
+                parts.append(encoding.decode(tokens[:remaining]))
+            break
+        parts.append(block)
+        remaining -= len(tokens) + 1
+
+    return "\n\n".join(parts)
@@ -0,0 +1,15 @@
+from langchain_huggingface import HuggingFaceEmbeddings
+
+# One embedding model for every agent: the model is large, so it must only be loaded once per process
+EMBEDDING_MODEL_NAME = "intfloat/multilingual-e5-large-instruct"
+# Every index built from these embeddings (RAG documents, database schemas) is stored here
+INDEX_DIR = "./index"
+
+embedding_model = None
+
+def get_embedding_model():
+    # created on first use
+    global embedding_model
+    if embedding_model is None:
+        embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    return embedding_model
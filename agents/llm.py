@@ -0,0 +1,223 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any
+
+from langchain.chat_models import init_chat_model
+from langchain_core.callbacks import CallbackManager
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import convert_to_openai_messages
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+class LLMCache:
+    """
+        Bounded LRU cache of chat model responses that also tracks in-flight requests,
+        so identical concurrent requests wait for one upstream call instead of each paying for it.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+
+    def record_usage(self, message) -> float:
+        """
+            Count prompt tokens of an upstream response and how many of them the provider served from its prompt cache.
+
+            Return:
+            cached token ratio of this response
+        """
+        ratio = cached_token_ratio(message)
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            return ratio
+        with self.lock:
+            self.input_tokens += usage.get("input_tokens", 0)
+            self.cached_input_tokens += usage.get("input_token_details", {}).get("cache_read", 0)
+        return ratio
+
+    def get_or_call(self, key, call, cacheable: bool):
+        """
+            Return the cached response for key, wait for an identical in-flight call,
+            or run call() and share its result.
+
+            Return:
+            (response, shared) where shared is True when the response was not produced for this caller
+        """
+        with self.lock:
+            if cacheable and key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key], True
+            if key in self.in_flight:
+                future = self.in_flight[key]
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self.in_flight[key] = Future()
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            response = call()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response, False
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                if cacheable and future.exception() is None:
+                    self.entries[key] = future.result()
+                    if len(self.entries) > self.maxsize:
+                        self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.coalesced + self.misses
+            return {
+                "requests": requests,
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.coalesced) / requests if requests else 0.0,
+                "size": len(self.entries),
+                "input_tokens": self.input_tokens,
+                "cached_input_tokens": self.cached_input_tokens,
+                "cached_token_ratio": self.cached_input_tokens / self.input_tokens if self.input_tokens else 0.0,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.coalesced = self.misses = 0
+            self.input_tokens = self.cached_input_tokens = 0
+
+# shared by every agent, so the same prompt sent from different graphs is deduplicated too
+llm_cache = LLMCache()
+
+def llm_cache_stats():
+    return llm_cache.stats()
+
+def cached_token_ratio(message) -> float:
+    """ Share of the prompt tokens of a single response that were read from the provider's prompt cache. """
+    # CachedChatModel responses carry the ratio recorded for the upstream call instead of the usage itself
+    if "cached_token_ratio" in message.response_metadata:
+        return message.response_metadata["cached_token_ratio"]
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens = usage.get("input_tokens", 0)
+    return usage.get("input_token_details", {}).get("cache_read", 0) / input_tokens if input_tokens else 0.0
+
+def child_callbacks(run_manager):
+    """ Callback manager for a run nested under the given chat model run (LLM run managers have no get_child). """
+    if run_manager is None:
+        return None
+    manager = CallbackManager(handlers=[], parent_run_id=run_manager.run_id)
+    manager.set_handlers(run_manager.inheritable_handlers)
+    manager.add_tags(run_manager.inheritable_tags)
+    manager.add_metadata(run_manager.inheritable_metadata)
+    return manager
+
+class CachedChatModel(BaseChatModel):
+    """
+        Chat model wrapper that deduplicates requests through the shared LLMCache.
+
+        A request is identified by the messages as sent to the provider, the bound tools and call
+        parameters, and the parameters of the wrapped model. In-flight duplicates are always coalesced;
+        finished responses are only reused for deterministic (temperature 0) calls unless
+        cache_nondeterministic is set.
+    """
+
+    model: BaseChatModel
+    cache_nondeterministic: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cached-{self.model._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return self.model._identifying_params
+
+    def bind_tools(self, tools, **kwargs):
+        # let the wrapped model format the tools for its provider, then bind the result to the wrapper
+        return self.bind(**self.model.bind_tools(tools, **kwargs).kwargs)
+
+    def request_key(self, messages, stop, kwargs) -> str:
+        request = {
+            "model": self._identifying_params,
+            "messages": convert_to_openai_messages(messages),
+            "stop": stop,
+            "kwargs": kwargs,
+        }
+        serialized = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def is_deterministic(self, kwargs) -> bool:
+        return kwargs.get("temperature", getattr(self.model, "temperature", None)) == 0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        key = self.request_key(messages, stop, kwargs)
+        cacheable = self.cache_nondeterministic or self.is_deterministic(kwargs)
+
+        def call():
+            # the wrapped model runs as a child of this run, so tracing nests it and token streaming keeps working
+            response = self.model.invoke(messages, stop=stop, config={"callbacks": child_callbacks(run_manager)}, **kwargs)
+            return response, llm_cache.record_usage(response)
+
+        (response, ratio), shared = llm_cache.get_or_call(key, call, cacheable)
+        message = response.model_copy(deep=True)
+        # the upstream call already reported its tokens in its own run, so this run must not count them again
+        message.usage_metadata = None
+        message.response_metadata.pop("token_usage", None)
+        # nothing was spent on a shared response, so nothing was read from the prompt cache for it either
+        message.response_metadata["cached_token_ratio"] = 0.0 if shared else ratio
+        if shared:
+            # a reused message id would replace the earlier message in MessagesState instead of being appended
+            message.id = None
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+def init_cached_chat_model(*args, cache_nondeterministic: bool = False, **kwargs):
+    """ Same arguments as init_chat_model, returns the model wrapped in a CachedChatModel. """
+    return CachedChatModel(model=init_chat_model(*args, **kwargs), cache_nondeterministic=cache_nondeterministic)
+
+def check_usage_accounting():
+    """
+        Check with a fake model that one upstream call reports its tokens exactly once
+        and that its run is nested under the CachedChatModel run.
+    """
+    from langchain_core.callbacks import get_usage_metadata_callback
+    from langchain_core.language_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.tracers.context import collect_runs
+
+    usage = {"input_tokens": 10, "output_tokens": 1, "total_tokens": 11}
+    inner = GenericFakeChatModel(messages=iter([AIMessage(content="ok", usage_metadata=usage,
+                                                          response_metadata={"model_name": "fake"})]))
+    model = CachedChatModel(model=inner)
+    with get_usage_metadata_callback() as usage_callback, collect_runs() as runs:
+        model.invoke("check", temperature=0)
+    model.invoke("check", temperature=0)
+
+    reported = list(usage_callback.usage_metadata.values())
+    assert reported == [usage], f"tokens reported {reported}, expected {usage} once"
+    roots = [run for run in runs.traced_runs if run.parent_run_id is None]
+    assert len(roots) == 1 and roots[0].name == "CachedChatModel", f"top-level runs: {[run.name for run in roots]}"
+    assert [child.name for child in roots[0].child_runs] == ["GenericFakeChatModel"], "upstream call is not nested"
+
+if __name__ == "__main__":
+    check_usage_accounting()
+    print("usage accounting ok")
@@ -0,0 +1,283 @@
+"""
+Load and soak testing for the compiled graphs, without calling a real model.
+
+Usage:
+    python -m agents.loadtest run deployed_agent/graph.py:graph --rate 20 --duration 60 --output base.json
+    python -m agents.loadtest run agents/graph.py:agent --rate 5 --duration 600 --tool-calls 3 --output serial.json
+    python -m agents.loadtest run agents/graph.py:agent --rate 5 --duration 600 --tool-calls 3 --parallel-tool-calls --output parallel.json
+    python -m agents.loadtest compare base.json new.json
+
+The graph is given like in langgraph.json ("path/to/file.py:attribute"). Before the graph module is
+loaded, init_chat_model is replaced by a fake chat model with a configurable latency, so the run
+measures the graph and its tools, not the provider. Requests arrive as an open-loop Poisson process
+(or at a constant rate), so a graph that cannot keep up builds a backlog instead of slowing the load down.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import psutil
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+class FakeChatModel(BaseChatModel):
+    """
+        Stand-in chat model. When tools are bound it calls the first tool tool_calls times before answering,
+        one call per turn if parallel_tool_calls=False was bound, otherwise all calls in one turn.
+        force_parallel ignores the bound setting, to measure what serializing the tool calls costs.
+    """
+
+    latency: float = 0.2
+    jitter: float = 0.05
+    tool_calls: int = 2
+    force_parallel: bool = False
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-loadtest"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def respond(self, messages, tools, parallel_tool_calls):
+        self.calls += 1
+        done = sum(message.type == "tool" for message in messages)
+        if not tools or done >= self.tool_calls:
+            return AIMessage(content=f"Answer after {done} tool calls.")
+
+        tool = tools[0]["function"]
+        # every declared parameter gets the value 1, enough for the tutorial tools
+        args = {name: 1 for name in tool.get("parameters", {}).get("properties", {})}
+        count = self.tool_calls - done if parallel_tool_calls or self.force_parallel else 1
+        tool_calls = [{"name": tool["name"], "args": args, "id": f"call_{done + i}", "type": "tool_call"} for i in range(count)]
+        return AIMessage(content="", tool_calls=tool_calls)
+
+    def delay(self):
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.delay())
+        message = self.respond(messages, kwargs.get("tools"), kwargs.get("parallel_tool_calls", True))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.delay())
+        message = self.respond(messages, kwargs.get("tools"), kwargs.get("parallel_tool_calls", True))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+fake_models = []
+
+def load_graph(spec, latency, jitter, tool_calls, force_parallel=False):
+    """ Load "path/to/file.py:attribute" with init_chat_model replaced by FakeChatModel. """
+    path, attribute = spec.rsplit(":", 1)
+
+    def fake_init_chat_model(*args, **kwargs):
+        model = FakeChatModel(latency=latency, jitter=jitter, tool_calls=tool_calls, force_parallel=force_parallel)
+        fake_models.append(model)
+        return model
+
+    import langchain.chat_models
+    langchain.chat_models.init_chat_model = fake_init_chat_model
+    if "agents.llm" in sys.modules:
+        sys.modules["agents.llm"].init_chat_model = fake_init_chat_model
+
+    module_spec = importlib.util.spec_from_file_location(f"loadtest_target_{os.path.basename(path)[:-3]}", path)
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    return getattr(module, attribute)
+
+class LatencyHistogram:
+    """ Log-scaled latency histogram (10% wide buckets), fixed memory however long the run is. """
+
+    GROWTH = 1.1
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        milliseconds = max(seconds * 1000, 1.0)
+        self.buckets[math.ceil(math.log(milliseconds, self.GROWTH))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """ Upper bound of the bucket holding the p-th percentile, capped at the slowest request seen, in milliseconds. """
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return round(min(self.GROWTH ** bucket, self.max * 1000), 2)
+        return round(self.max * 1000, 2)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max * 1000, 2),
+            "buckets_ms": {round(self.GROWTH ** bucket, 2): count for bucket, count in sorted(self.buckets.items())},
+        }
+
+async def run_load(graph, rate, duration, arrival="poisson", max_in_flight=1000, sample_interval=1.0, question="what is 4 + 7"):
+    """
+        Send requests to the graph at the given arrival rate for duration seconds and wait for them to finish.
+
+        Return:
+        report dict with latency, error and memory figures
+    """
+    process = psutil.Process()
+    histogram = LatencyHistogram()
+    errors = Counter()
+    memory = []
+    in_flight = set()
+    sent = dropped = 0
+    start = time.perf_counter()
+
+    async def one_request():
+        began = time.perf_counter()
+        try:
+            await graph.ainvoke({"messages": [HumanMessage(content=question)]})
+            histogram.record(time.perf_counter() - began)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+
+    async def sample_memory():
+        while True:
+            memory.append({
+                "t": round(time.perf_counter() - start, 2),
+                "rss_mb": round(process.memory_info().rss / 2**20, 2),
+                "in_flight": len(in_flight),
+                "completed": histogram.count,
+            })
+            await asyncio.sleep(sample_interval)
+
+    sampler = asyncio.create_task(sample_memory())
+    next_arrival = start
+    while next_arrival - start < duration:
+        await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+        if len(in_flight) >= max_in_flight:
+            dropped += 1
+        else:
+            task = asyncio.create_task(one_request())
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            sent += 1
+        next_arrival += random.expovariate(rate) if arrival == "poisson" else 1 / rate
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    memory.append({"t": round(elapsed, 2), "rss_mb": round(process.memory_info().rss / 2**20, 2), "in_flight": 0, "completed": histogram.count})
+
+    failed = sum(errors.values())
+    return {
+        "config": {"rate": rate, "duration": duration, "arrival": arrival, "max_in_flight": max_in_flight},
+        "elapsed_s": round(elapsed, 2),
+        "sent": sent,
+        "dropped": dropped,
+        "completed": histogram.count,
+        "errors": dict(errors),
+        "error_rate": failed / sent if sent else 0.0,
+        "throughput_rps": round(histogram.count / elapsed, 2) if elapsed else 0.0,
+        "model_calls_per_request": round(sum(model.calls for model in fake_models) / sent, 2) if sent else 0.0,
+        "latency": histogram.summary(),
+        "memory": {
+            "start_mb": memory[0]["rss_mb"],
+            "end_mb": memory[-1]["rss_mb"],
+            "peak_mb": max(sample["rss_mb"] for sample in memory),
+            "growth_mb": round(memory[-1]["rss_mb"] - memory[0]["rss_mb"], 2),
+            "samples": memory,
+        },
+    }
+
+# metric name -> function reading it from a report; for all of them lower is better except throughput
+COMPARED_METRICS = {
+    "throughput_rps": lambda report: report["throughput_rps"],
+    "error_rate": lambda report: report["error_rate"],
+    "dropped": lambda report: report["dropped"],
+    "model_calls_per_request": lambda report: report["model_calls_per_request"],
+    "p50_ms": lambda report: report["latency"]["p50_ms"],
+    "p95_ms": lambda report: report["latency"]["p95_ms"],
+    "p99_ms": lambda report: report["latency"]["p99_ms"],
+    "max_ms": lambda report: report["latency"]["max_ms"],
+    "memory_peak_mb": lambda report: report["memory"]["peak_mb"],
+    "memory_growth_mb": lambda report: report["memory"]["growth_mb"],
+}
+
+def compare_reports(base, new):
+    """ Return the lines of a table comparing two run reports. """
+    lines = [f"{'metric':<26}{'base':>12}{'new':>12}{'change':>10}"]
+    for name, read in COMPARED_METRICS.items():
+        base_value, new_value = read(base), read(new)
+        change = f"{(new_value - base_value) / base_value * 100:+.1f}%" if base_value else "n/a"
+        lines.append(f"{name:<26}{base_value:>12}{new_value:>12}{change:>10}")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and soak test a compiled graph with a fake chat model.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="drive a graph and write a JSON report")
+    run.add_argument("graph", help='graph to load, e.g. "deployed_agent/graph.py:graph"')
+    run.add_argument("--rate", type=float, default=10.0, help="requests per second")
+    run.add_argument("--duration", type=float, default=30.0, help="seconds of load, use long durations for soak runs")
+    run.add_argument("--arrival", choices=["poisson", "constant"], default="poisson")
+    run.add_argument("--max-in-flight", type=int, default=1000, help="requests above this backlog are dropped and counted")
+    run.add_argument("--latency", type=float, default=0.2, help="mean fake model latency in seconds")
+    run.add_argument("--jitter", type=float, default=0.05, help="standard deviation of the fake model latency")
+    run.add_argument("--tool-calls", type=int, default=2, help="tool calls the fake model makes per request when tools are bound")
+    run.add_argument("--parallel-tool-calls", action="store_true", help="make all tool calls in one turn even if parallel_tool_calls=False is bound")
+    run.add_argument("--sample-interval", type=float, default=1.0, help="seconds between memory samples")
+    run.add_argument("--question", default="what is 4 + 7")
+    run.add_argument("--output", default="loadtest_report.json")
+
+    compare = commands.add_parser("compare", help="compare two JSON reports")
+    compare.add_argument("base")
+    compare.add_argument("new")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        print("\n".join(compare_reports(base, new)))
+        return
+
+    graph = load_graph(args.graph, args.latency, args.jitter, args.tool_calls, args.parallel_tool_calls)
+    report = asyncio.run(run_load(graph, args.rate, args.duration, args.arrival, args.max_in_flight, args.sample_interval, args.question))
+    report["config"].update({"graph": args.graph, "latency": args.latency, "jitter": args.jitter, "tool_calls": args.tool_calls,
+                             "parallel_tool_calls": args.parallel_tool_calls})
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency = report["latency"]
+    print(f"{report['completed']}/{report['sent']} completed, {report['dropped']} dropped, error rate {report['error_rate']:.2%}")
+    print(f"latency p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms, p99 {latency['p99_ms']} ms, max {latency['max_ms']} ms")
+    print(f"memory {report['memory']['start_mb']} -> {report['memory']['end_mb']} MB (peak {report['memory']['peak_mb']} MB)")
+    print(f"report written to {args.output}")
+
+if __name__ == "__main__":
+    main()
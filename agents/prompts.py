@@ -0,0 +1,78 @@
+"""
+Prompt building for the DBQNA and RAG agents.
+
+Providers cache the longest prompt prefix they have seen before (OpenAI does this automatically from
+1024 tokens on). Every prompt is therefore built as a byte-stable prefix (static instructions and
+database schema, identical for every request) followed by the per-request content (question, query
+results, retrieved context). Keep anything that changes per request out of the instructions below.
+"""
+from langchain_core.messages import HumanMessage, SystemMessage
+
+DIALECT = "sqlite"
+TOP_K = 10
+
+GET_SCHEMA_INSTRUCTION = '''You are a business analyst from Dexa and an SQL expert. You receive a question from the user and a list of available
+table in the database. Use the tool to get the structures of possible tables that you will use to construct the query later.
+The database name and the question from the user are given in the last message.'''
+
+WRITE_QUERY_INSTRUCTION = f'''You are an agent designed to interact with a SQL database.
+Given an input question, create a syntactically correct {DIALECT} query to run,
+then look at the results of the query and return the answer. Unless the user
+specifies a specific number of examples they wish to obtain, always limit your
+query to at most {TOP_K} results.
+
+You can order the results by a relevant column to return the most interesting
+examples in the database. Never query for all the columns from a specific table,
+only ask for the relevant columns given the question.
+
+DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the database.'''
+
+CHECK_QUERY_INSTRUCTION = f'''You are a SQL expert with a strong attention to detail.
+Double check the {DIALECT} query for common mistakes, including:
+- Using NOT IN with NULL values
+- Using UNION when UNION ALL should have been used
+- Using BETWEEN for exclusive ranges
+- Data type mismatch in predicates
+- Properly quoting identifiers
+- Using the correct number of arguments for functions
+- Casting to the correct data type
+- Using the proper columns for joins
+
+If there are any of the above mistakes, rewrite the query. If there are no mistakes,
+just reproduce the original query.
+
+Forbid any DML statements (INSERT, UPDATE, DELETE, DROP, TRUNCATE). If the query statement contains those statements, respond by "Forbidden query"'''
+
+RUN_QUERY_INSTRUCTION = f'''If the last node is resulted in a forbidden query, proceed to the next node, explain why it is forbidden and skip calling tool.
+If the result is a valid {DIALECT} query statement, run the query by calling the given tool.'''
+
+FINAL_ANSWER_INSTRUCTION = '''Decide whether you can answer user question from the query result. If you have enough information,
+respond with the answer.
+If you do not have enough information, tell me your plan to get more accurate answer.
+The user question and the query result are given in the last message.'''
+
+IS_ENOUGH_INSTRUCTION = """Answer only with 'enough' or 'not enough'. Answer with 'enough', if your response indicate that
+there is enough information from the tool message to answer user question. Answer with 'enough' when
+the user asks you to perform a forbidden query. Answer with 'not enough' if otherwise."""
+
+RAG_GENERATE_INSTRUCTION = (
+    "You are an assistant for question-answering tasks. "
+    "Use the retrieved context given in the last message to answer "
+    "the question. If you don't know the answer, say that you "
+    "don't know. Keep the answer concise."
+)
+
+def build_prompt(prefix, request):
+    """
+        Assemble a prompt from a static prefix and the per-request content.
+
+        Args:
+        prefix = static parts, identical for every request (strings become system messages)
+        request = per-request parts, placed last (strings become human messages)
+
+        Return:
+        list of messages
+    """
+    static_messages = [SystemMessage(content=part) if isinstance(part, str) else part for part in prefix]
+    request_messages = [HumanMessage(content=part) if isinstance(part, str) else part for part in request]
+    return static_messages + request_messages
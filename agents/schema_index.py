@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from agents.embeddings import EMBEDDING_MODEL_NAME, INDEX_DIR, get_embedding_model
+
+SAMPLE_VALUES = 3
+SAMPLE_VALUE_LENGTH = 40
+
+def schema_version(db_name):
+    """ Hash of the DDL of all tables, it only changes when the schema changes. """
+    connection = sqlite3.connect(db_name)
+    rows = connection.execute("SELECT name, sql FROM sqlite_master WHERE type='table' ORDER BY name;").fetchall()
+    connection.close()
+    return hashlib.sha256(json.dumps(rows).encode()).hexdigest()[:16]
+
+def describe_tables(db_name):
+    """
+        Build a text description of every table for embedding: table name, columns with their types
+        and a few sample values per column.
+
+        Return:
+        dict of table name to description
+    """
+    connection = sqlite3.connect(db_name)
+    cursor = connection.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    tables = [table[0] for table in cursor.fetchall()]
+
+    descriptions = {}
+    for table in tables:
+        cursor.execute(f'PRAGMA table_info("{table}");')
+        columns = [(column[1], column[2]) for column in cursor.fetchall()]
+
+        samples = []
+        for name, _ in columns:
+            cursor.execute(f'SELECT DISTINCT "{name}" FROM "{table}" WHERE "{name}" IS NOT NULL LIMIT {SAMPLE_VALUES};')
+            values = [str(row[0])[:SAMPLE_VALUE_LENGTH] for row in cursor.fetchall()]
+            if values:
+                samples.append(f"{name}: {', '.join(values)}")
+
+        column_list = ", ".join(f"{name} ({type})" for name, type in columns)
+        descriptions[table] = f"Table {table}. Columns: {column_list}. Sample values: {'; '.join(samples)}"
+
+    connection.close()
+    return descriptions
+
+class SchemaIndex:
+    """ Embeddings of table descriptions used to pick the tables relevant to a question. """
+
+    def __init__(self, tables, embeddings):
+        self.tables = tables
+        # normalized, so the dot product is the cosine similarity
+        self.embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    @classmethod
+    def build(cls, db_name):
+        descriptions = describe_tables(db_name)
+        tables = list(descriptions)
+        embeddings = np.array(get_embedding_model().embed_documents([descriptions[table] for table in tables]), dtype=np.float32)
+        return cls(tables, embeddings)
+
+    def save(self, path):
+        np.savez(path, tables=np.array(self.tables), embeddings=self.embeddings)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["tables"].tolist(), data["embeddings"])
+
+    def search(self, question, n=10):
+        """ Return the names of the n tables most relevant to the question, best first. """
+        query = np.array(get_embedding_model().embed_query(question), dtype=np.float32)
+        scores = self.embeddings @ (query / np.linalg.norm(query))
+        return [self.tables[i] for i in np.argsort(-scores)[:n]]
+
+schema_indexes = {}
+
+def get_schema_index(db_name):
+    """ Load the index for the current version of the database, building and saving it the first time. """
+    version = schema_version(db_name)
+    key = (os.path.abspath(db_name), version)
+    if key not in schema_indexes:
+        db_label = os.path.splitext(os.path.basename(db_name))[0]
+        # the embedding model is part of the name, vectors of different models are not comparable
+        model_tag = hashlib.sha256(EMBEDDING_MODEL_NAME.encode()).hexdigest()[:8]
+        path = os.path.join(INDEX_DIR, f"schema_{db_label}_{version}_{model_tag}.npz")
+        if os.path.exists(path):
+            schema_indexes[key] = SchemaIndex.load(path)
+        else:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            schema_indexes[key] = SchemaIndex.build(db_name)
+            schema_indexes[key].save(path)
+    return schema_indexes[key]
+
+def select_tables(question, db_name, n=10):
+    return get_schema_index(db_name).search(question, n)
@@ -4,12 +4,14 @@ from langchain_core.messages import AIMessageChunk, HumanMessage, AIMessage, Sys
 import agents.graph as gr
 import agents.DBQNA as DBQNA
 import agents.RAG as RAG
+from agents.llm import init_cached_chat_model, llm_cache_stats
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langgraph.graph import MessagesState, StateGraph, START, END
 from langgraph.types import Command
 from typing import Literal
 from pydantic import BaseModel, Field
+from langchain_core.output_parsers.openai_tools import PydanticToolsParser
 from langgraph.checkpoint.memory import InMemorySaver
 
 st.title("Simple Graph with Streamlit")
@@ -26,8 +28,7 @@ st.write_stream(get_stream)
 
 DB_PATH = os.environ['DB_PATH']
 
-from langchain.chat_models import init_chat_model
-model = init_chat_model("gpt-4.1-mini", model_provider= "openai")
+model = init_cached_chat_model("gpt-4.1-mini", model_provider= "openai")
 
 class BestAgent(BaseModel):
     agent_name: str = Field(description = "The best agent to handle specific request from users.")
@@ -42,7 +43,11 @@ def supervisor(state: SupervisorState) -> Command[Literal["DBQNA", "RAG", END]]:
                                     Delegate to RAG agent if users ask a question about Dexa Medica. 
                                     End the conversation after you receive answer from agents.
                                  """)]
-    model_with_structure = model.with_structured_output(BestAgent)
+    # routing is pinned to temperature 0 so repeated questions are served from the LLM cache
+    model_with_structure = (
+        model.bind_tools([BestAgent], tool_choice="BestAgent").bind(temperature=0)
+        | PydanticToolsParser(tools=[BestAgent], first_tool_only=True)
+    )
     response = model_with_structure.invoke(instruction + [last_message])
     return Command(
         update= {'user_question': last_message.content},
@@ -102,6 +107,10 @@ if prompt:
         
         status_placeholder.status(label="Complete", state='complete')
 
+# LLM request deduplication (shared by the supervisor, DBQNA and RAG)
+st.sidebar.write("LLM cache")
+st.sidebar.json(llm_cache_stats())
+
 # DBQNA.graph.stream({"messages":HumanMessage(content=prompt), "db_name": DB_PATH, "user_question" : prompt}, stream_mode="messages")
 # RAG.graph.stream({"messages":HumanMessage(content=prompt)}, stream_mode="messages")
             
\ No newline at end of file